@@ -3,6 +3,7 @@
 
 Usage:
     python depth_estimate.py --input terrain.png --output depth.bin [--width 512] [--height 512]
+    python depth_estimate.py --worker    # keep the model loaded, read JSON jobs from stdin (see jobs.py)
 
 Outputs raw float32 binary (row-major, little-endian) normalized to [0, 1].
 Prints JSON status to stdout: {"success": true, "output": "path"} or {"success": false, "error": "msg"}.
@@ -11,75 +12,114 @@ Prints JSON status to stdout: {"success": true, "output": "path"} or {"success":
 import argparse
 import json
 import sys
-import numpy as np
 
-def main():
-    parser = argparse.ArgumentParser(description="Depth Anything V2 depth estimation")
-    parser.add_argument("--input", required=True, help="Input image path (PNG)")
-    parser.add_argument("--output", required=True, help="Output path for raw f32 binary")
-    parser.add_argument("--width", type=int, default=512, help="Output width")
-    parser.add_argument("--height", type=int, default=512, help="Output height")
-    args = parser.parse_args()
+from jobs import error_status, init_torch_env, serve
 
-    try:
-        import torch
-        from PIL import Image
-        from transformers import AutoImageProcessor, AutoModelForDepthEstimation
-
-        # Select device
-        if torch.backends.mps.is_available():
-            device = torch.device("mps")
-        elif torch.cuda.is_available():
-            device = torch.device("cuda")
-        else:
-            device = torch.device("cpu")
+# Options that only take effect while loading the model; jobs may not override them
+LOAD_ARGS = ("no_compile",)
 
-        # Load model
-        model_name = "depth-anything/Depth-Anything-V2-Small-hf"
-        processor = AutoImageProcessor.from_pretrained(model_name)
-        model = AutoModelForDepthEstimation.from_pretrained(model_name)
-        model.to(device).eval()
 
-        # Load and process image
-        image = Image.open(args.input).convert("RGB")
-        inputs = processor(images=image, return_tensors="pt").to(device)
-
-        # Inference
-        with torch.no_grad():
-            outputs = model(**inputs)
-            predicted_depth = outputs.predicted_depth
-
-        # Post-process: resize to target dimensions
+def build_parser(worker=False):
+    # In worker mode the per-job arguments arrive with each job instead
+    parser = argparse.ArgumentParser(description="Depth Anything V2 depth estimation")
+    parser.add_argument("--input", required=not worker, help="Input image path (PNG)")
+    parser.add_argument("--output", required=not worker, help="Output path for raw f32 binary")
+    parser.add_argument("--width", type=int, default=512, help="Output width")
+    parser.add_argument("--height", type=int, default=512, help="Output height")
+    parser.add_argument("--no-compile", action="store_true",
+                        help="Skip torch.compile (faster cold start, slower inference)")
+    parser.add_argument("--worker", action="store_true",
+                        help="Keep the model loaded and serve JSON jobs from stdin")
+    return parser
+
+
+def load_model(args):
+    """Load Depth Anything on the best available device. Returns (processor, model, device)."""
+    import torch
+    from transformers import AutoImageProcessor, AutoModelForDepthEstimation
+
+    # Select device
+    if torch.backends.mps.is_available():
+        device = torch.device("mps")
+    elif torch.cuda.is_available():
+        device = torch.device("cuda")
+    else:
+        device = torch.device("cpu")
+
+    # Load model (float16 on CUDA; MPS/CPU stay float32)
+    model_name = "depth-anything/Depth-Anything-V2-Small-hf"
+    dtype = torch.float16 if device.type == "cuda" else torch.float32
+    processor = AutoImageProcessor.from_pretrained(model_name)
+    model = AutoModelForDepthEstimation.from_pretrained(model_name, torch_dtype=dtype)
+    model.to(device).eval()
+
+    # The processor always emits the same input shape for a given capture size,
+    # so the compiled graph is reused; the first call pays the compile warm-up.
+    if device.type == "cuda" and not args.no_compile:
+        model = torch.compile(model, mode="reduce-overhead", fullgraph=True)
+
+    return processor, model, device
+
+
+def estimate(processor, model, device, args):
+    """Run one depth estimation job and return its JSON status."""
+    import torch
+
+    from image_ops import load_rgb
+
+    # Load and process image
+    image = load_rgb(args.input)
+    inputs = processor(images=image, return_tensors="pt").to(device, dtype=model.dtype)
+
+    # Inference; post-processing stays on the device so only the final map is copied back
+    with torch.inference_mode():
+        outputs = model(**inputs)
+        predicted_depth = outputs.predicted_depth
+
+        # Post-process: resize to target dimensions. Upcast first: float16 would
+        # quantize the normalized heights into visible terraces.
         depth = torch.nn.functional.interpolate(
-            predicted_depth.unsqueeze(1),
+            predicted_depth.float().unsqueeze(1),
             size=(args.height, args.width),
             mode="bicubic",
             align_corners=False,
         ).squeeze()
 
-        depth_np = depth.cpu().numpy().astype(np.float32)
-
-        # Normalize to [0, 1]
-        d_min = depth_np.min()
-        d_max = depth_np.max()
-        if d_max - d_min > 1e-6:
-            depth_np = (depth_np - d_min) / (d_max - d_min)
-        else:
-            depth_np = np.zeros_like(depth_np)
+        # Normalize to [0, 1] (flat maps become all zeros)
+        d_min = depth.amin()
+        d_range = depth.amax() - d_min
+        depth = torch.where(d_range > 1e-6, (depth - d_min) / d_range.clamp_min(1e-6),
+                            torch.zeros_like(depth))
 
         # Depth Anything: smaller values = closer to camera.
         # For top-down view: closer = higher terrain.
         # So we invert: high terrain should have large values in the heightmap.
-        depth_np = 1.0 - depth_np
+        depth = 1.0 - depth
+
+    # Already contiguous float32, so this is a single device -> host copy
+    depth_np = depth.contiguous().cpu().numpy()
 
-        # Write raw f32 binary (row-major, little-endian)
-        with open(args.output, "wb") as f:
-            f.write(depth_np.tobytes())
+    # Write raw f32 binary (row-major, little-endian) straight from the array buffer
+    depth_np.tofile(args.output)
 
-        print(json.dumps({"success": True, "output": args.output}))
+    return {"success": True, "output": args.output}
+
+
+def main():
+    args = build_parser(worker="--worker" in sys.argv[1:]).parse_args()
+
+    try:
+        init_torch_env()
+
+        processor, model, device = load_model(args)
+
+        if args.worker:
+            serve(lambda job_args: estimate(processor, model, device, job_args), args, LOAD_ARGS)
+        else:
+            print(json.dumps(estimate(processor, model, device, args)))
 
     except Exception as e:
-        print(json.dumps({"success": False, "error": str(e)}))
+        print(json.dumps(error_status(e)))
         sys.exit(1)
 
 
@@ -0,0 +1,96 @@
+"""Image helpers shared by the generation scripts."""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+DEBUG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "debug")
+
+# Non-daemon, so queued debug images are still written before the interpreter exits
+_debug_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="debug-png")
+
+
+def save_png(img, path):
+    """Save a PIL image as PNG with fast zlib settings.
+
+    Every PNG written here is a short-lived intermediate, so level 1 is a
+    better trade than PIL's default of 6 (several times slower to encode).
+    """
+    img.save(path, compress_level=1)
+
+
+def _report_failure(future):
+    if future.exception() is not None:
+        print(f"Debug image save failed: {future.exception()}", file=sys.stderr)
+
+
+def save_debug(img, name):
+    """Queue `img` to be written to ml/debug/<name> in the background."""
+    os.makedirs(DEBUG_DIR, exist_ok=True)
+    future = _debug_pool.submit(save_png, img, os.path.join(DEBUG_DIR, name))
+    future.add_done_callback(_report_failure)
+
+
+def _load(path, flags, size):
+    arr = cv2.imread(path, flags)
+    if arr is None:
+        raise ValueError(f"Could not read image: {path}")
+    if size is not None and (arr.shape[1], arr.shape[0]) != tuple(size):
+        shrinking = size[0] * size[1] < arr.shape[0] * arr.shape[1]
+        interp = cv2.INTER_AREA if shrinking else cv2.INTER_CUBIC
+        arr = cv2.resize(arr, tuple(size), interpolation=interp)
+    return arr
+
+
+def load_rgb(path, size=None):
+    """Decode an image as an RGB PIL image, optionally resized to `size` (w, h).
+
+    Drop-in for Image.open(path).convert("RGB").resize(size) using OpenCV's
+    libjpeg-turbo/libpng decoders and SIMD resize. Alpha is discarded.
+    """
+    from PIL import Image
+
+    bgr = _load(path, cv2.IMREAD_COLOR, size)
+    return Image.fromarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
+
+
+def load_gray(path, size=None):
+    """Decode an image as an "L" PIL image, optionally resized to `size` (w, h)."""
+    from PIL import Image
+
+    return Image.fromarray(_load(path, cv2.IMREAD_GRAYSCALE, size))
+
+
+def feather_mask(mask, radius):
+    """Gaussian-blur a uint8 (H, W) mask, with `radius` as the standard deviation.
+
+    Matches PIL's ImageFilter.GaussianBlur(radius) but uses OpenCV's
+    separable SIMD kernel and stays in uint8.
+    """
+    if radius <= 0:
+        return mask
+    return cv2.GaussianBlur(mask, (0, 0), sigmaX=radius, borderType=cv2.BORDER_REPLICATE)
+
+
+def blend_masked(orig, gen, alpha):
+    """Blend `gen` over `orig` with uint8 per-pixel weights `alpha` (255 = gen).
+
+    orig/gen are uint8 arrays of shape (H, W) or (H, W, C); alpha is (H, W).
+    Computes the rounded integer lerp (orig * (255 - a) + gen * a + 127) // 255
+    in uint16, where the largest intermediate (255 * 255 + 127) still fits,
+    so there is no uint8 -> float32 -> uint8 round-trip.
+    """
+    a = alpha.astype(np.uint16)
+    if orig.ndim == 3:
+        a = a[:, :, None]
+    out = orig.astype(np.uint16)
+    out *= 255 - a
+    weighted = gen.astype(np.uint16)
+    weighted *= a
+    out += weighted
+    out += 127
+    out //= 255
+    return out.astype(np.uint8)
@@ -6,6 +6,7 @@ the masked region of the original terrain image with feathered blending.
 
 Usage:
     python inpaint.py --image terrain.png --mask mask.png --prompt "volcanic crater" --output result.png
+    python inpaint.py --worker    # keep SDXL loaded, read JSON jobs from stdin (see jobs.py)
 
 Mask: white (255) = regions to replace, black (0) = keep original.
 Prints JSON status to stdout.
@@ -15,134 +16,204 @@ import argparse
 import json
 import sys
 
+from jobs import PIPELINE_LOAD_ARGS, add_pipeline_args, error_status, init_torch_env, serve
 
-def main():
+
+# Options that only take effect while loading the model; jobs may not override them
+LOAD_ARGS = PIPELINE_LOAD_ARGS + ("turbo",)
+
+
+def build_parser(worker=False):
+    # In worker mode the per-job arguments arrive with each job instead
     parser = argparse.ArgumentParser(description="SD terrain generation + compositing")
-    parser.add_argument("--image", required=True, help="Input image path (PNG)")
-    parser.add_argument("--mask", required=True, help="Mask image path (white = replace)")
-    parser.add_argument("--prompt", required=True, help="Text prompt")
-    parser.add_argument("--output", required=True, help="Output PNG path")
-    parser.add_argument("--steps", type=int, default=30, help="Inference steps")
-    parser.add_argument("--guidance", type=float, default=10.0, help="Guidance scale")
+    parser.add_argument("--image", required=not worker, help="Input image path (PNG)")
+    parser.add_argument("--mask", required=not worker, help="Mask image path (white = replace)")
+    parser.add_argument("--prompt", required=not worker, help="Text prompt")
+    parser.add_argument("--output", required=not worker, help="Output PNG path")
+    parser.add_argument("--steps", type=int, default=None, help="Inference steps (default: 15, turbo: 4)")
+    parser.add_argument("--guidance", type=float, default=None, help="Guidance scale (default: 10.0, turbo: 0.0)")
+    parser.add_argument("--gen_size", type=int, default=None,
+                        help="SDXL generation resolution before downscaling to 512 (default: 768, turbo: 512)")
     parser.add_argument("--negative", type=str, default="", help="Negative prompt")
     parser.add_argument("--feather", type=int, default=12, help="Mask feather radius in pixels")
     parser.add_argument("--seed", type=int, default=-1, help="Random seed (-1 = random)")
     parser.add_argument("--mode", type=str, default="texture", choices=["texture", "heightmap"],
                         help="Generation mode: texture (color image) or heightmap (grayscale heights)")
-    args = parser.parse_args()
-
-    try:
-        import os
-        os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
-
-        import numpy as np
-        import torch
-        from PIL import Image, ImageFilter
-        from diffusers import StableDiffusionXLPipeline
-
-        # Device selection: MPS float32, CUDA float16, CPU float32
-        if torch.backends.mps.is_available():
-            device = "mps"
-        elif torch.cuda.is_available():
-            device = "cuda"
-        else:
-            device = "cpu"
-
-        print(f"Using device: {device}", file=sys.stderr)
-
-        # SDXL: much better prompt adherence than SD 1.5
-        model_id = "stabilityai/stable-diffusion-xl-base-1.0"
-        if device == "cuda":
-            pipe = StableDiffusionXLPipeline.from_pretrained(
-                model_id,
-                torch_dtype=torch.float16,
-                variant="fp16",
-                use_safetensors=True,
-            ).to("cuda")
-        else:
-            # MPS + CPU: must use float32 (float16 has dtype mismatches on MPS)
-            pipe = StableDiffusionXLPipeline.from_pretrained(
-                model_id,
-                torch_dtype=torch.float32,
-                variant="fp16",
-                use_safetensors=True,
-            ).to(device)
-
-        pipe.enable_attention_slicing()
-
-        # Load images
-        image = Image.open(args.image).convert("RGB").resize((512, 512))
-        mask = Image.open(args.mask).convert("L").resize((512, 512))
-
-        # Debug: save copies and log mask stats
-        debug_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "debug")
-        os.makedirs(debug_dir, exist_ok=True)
-        image.save(os.path.join(debug_dir, "input_image.png"))
-        mask.save(os.path.join(debug_dir, "input_mask.png"))
+    parser.add_argument("--turbo", action="store_true",
+                        help="Load SDXL-Turbo (few-step, no CFG) instead of SDXL base")
+    add_pipeline_args(parser)
+    parser.add_argument("--worker", action="store_true",
+                        help="Keep the pipeline loaded and serve JSON jobs from stdin")
+    return parser
+
+
+def load_pipeline(args):
+    """Load SDXL on the best available device. Returns (pipe, device, prompt cache)."""
+    import torch
+    from diffusers import AutoencoderKL, StableDiffusionXLPipeline
+
+    from pipeline_opts import (
+        PromptCache, capture_cuda_graphs, compile_pipeline, configure_attention,
+        quantize_pipeline, use_channels_last, use_dpm_solver,
+    )
+
+    # Device selection: MPS float32, CUDA float16, CPU float32
+    if torch.backends.mps.is_available():
+        device = "mps"
+    elif torch.cuda.is_available():
+        device = "cuda"
+    else:
+        device = "cpu"
+
+    print(f"Using device: {device}", file=sys.stderr)
+
+    # SDXL: much better prompt adherence than SD 1.5. Turbo trades some quality for ~7x fewer steps.
+    model_id = "stabilityai/sdxl-turbo" if args.turbo else "stabilityai/stable-diffusion-xl-base-1.0"
+    if device == "cuda":
+        # The stock SDXL VAE overflows in float16, so diffusers upcasts it to float32
+        # and back on every decode. This finetune is fp16-safe and keeps it in place.
+        vae = AutoencoderKL.from_pretrained(
+            "madebyollin/sdxl-vae-fp16-fix",
+            torch_dtype=torch.float16,
+            force_upcast=False,
+        )
+        pipe = StableDiffusionXLPipeline.from_pretrained(
+            model_id,
+            vae=vae,
+            torch_dtype=torch.float16,
+            variant="fp16",
+            use_safetensors=True,
+        ).to("cuda")
+    else:
+        # MPS + CPU: must use float32 (float16 has dtype mismatches on MPS)
+        pipe = StableDiffusionXLPipeline.from_pretrained(
+            model_id,
+            torch_dtype=torch.float32,
+            variant="fp16",
+            use_safetensors=True,
+        ).to(device)
+
+    # Turbo ships with the scheduler it was distilled for
+    if not args.turbo:
+        use_dpm_solver(pipe)
+    configure_attention(pipe, device)
+    use_channels_last(pipe, device)
+    quantize_pipeline(pipe, device, args.quantize)
+
+    if args.no_compile:
+        capture_cuda_graphs(pipe, device)
+    else:
+        compile_pipeline(pipe, device)
+
+    return pipe, device, PromptCache(pipe, device)
+
+
+def generate(pipe, device, prompts, args):
+    """Run one generation + composite job and return its JSON status."""
+    import numpy as np
+    import torch
+    from PIL import Image
+
+    from image_ops import blend_masked, feather_mask, load_gray, load_rgb, save_debug, save_png
+
+    # Load images
+    image = load_rgb(args.image, (512, 512))
+    mask = load_gray(args.mask, (512, 512))
+
+    # Debug: save copies and log mask stats
+    if args.debug:
+        save_debug(image, "input_image.png")
+        save_debug(mask, "input_mask.png")
         mask_arr = np.array(mask)
         print(f"MASK_DEBUG: min={mask_arr.min()}, max={mask_arr.max()}, "
-              f"white_pixels={np.sum(mask_arr > 128)}, total={mask_arr.size}", file=sys.stderr)
+              f"white_pixels={np.count_nonzero(mask_arr > 128)}, total={mask_arr.size}", file=sys.stderr)
+
+    # Seed. On CUDA draw the noise on the GPU (no host copy, safe for graph capture);
+    # MPS keeps a CPU generator. Seeds are reproducible per device type only.
+    generator = None
+    if args.seed >= 0:
+        gen_device = "cuda" if device == "cuda" else "cpu"
+        generator = torch.Generator(device=gen_device).manual_seed(args.seed)
+
+    # Build prompt based on mode
+    if args.mode == "heightmap":
+        prompt = f"{args.prompt}, grayscale heightmap, top-down view, white is high elevation, black is low elevation, smooth gradients, no text, no labels"
+        negative = args.negative or "color, rgb, texture, photo, satellite, 3d render, text, labels, contour lines, cartoon, drawing"
+    else:
+        prompt = f"{args.prompt}, flat top-down orthographic satellite view, terrain texture map, no shadows, no lighting, no depth, uniform flat illumination"
+        negative = args.negative or "3d render, lighting, shadows, highlights, shading, depth, perspective, side view, horizon, volumetric, dramatic lighting, sun, cartoon, drawing, text, watermark"
+    print(f"Prompt: {prompt}", file=sys.stderr)
+    print(f"Negative: {negative}", file=sys.stderr)
+
+    # UNet cost grows with latent area, so default to 768 (SDXL still holds up there)
+    # rather than native 1024; turbo is trained at 512.
+    gen_size = args.gen_size or (512 if args.turbo else 768)
+    steps = args.steps if args.steps is not None else (4 if args.turbo else 15)
+    guidance = args.guidance if args.guidance is not None else (0.0 if args.turbo else 10.0)
+
+    # Decode large latents tile by tile to cap VAE memory
+    if gen_size >= 1024:
+        pipe.enable_vae_tiling()
+        pipe.enable_vae_slicing()
+    else:
+        pipe.disable_vae_tiling()
+        pipe.disable_vae_slicing()
+
+    with torch.no_grad():
+        generated = pipe(
+            **prompts.pipe_kwargs(prompt, negative, guidance),
+            num_inference_steps=steps,
+            guidance_scale=guidance,
+            width=gen_size,
+            height=gen_size,
+            generator=generator,
+        ).images[0]
+
+    if generated.size != (512, 512):
+        generated = generated.resize((512, 512), Image.LANCZOS)
+    if args.debug:
+        save_debug(generated, "generated_raw.png")
 
-        # Seed
-        generator = None
-        if args.seed >= 0:
-            generator = torch.Generator(device="cpu").manual_seed(args.seed)
+    # In heightmap mode, convert to grayscale
+    if args.mode == "heightmap":
+        generated = generated.convert("L")
+        if args.debug:
+            save_debug(generated, "generated_grayscale.png")
+        image = image.convert("L")
 
-        # Build prompt based on mode
-        if args.mode == "heightmap":
-            prompt = f"{args.prompt}, grayscale heightmap, top-down view, white is high elevation, black is low elevation, smooth gradients, no text, no labels"
-            negative = args.negative or "color, rgb, texture, photo, satellite, 3d render, text, labels, contour lines, cartoon, drawing"
-        else:
-            prompt = f"{args.prompt}, flat top-down orthographic satellite view, terrain texture map, no shadows, no lighting, no depth, uniform flat illumination"
-            negative = args.negative or "3d render, lighting, shadows, highlights, shading, depth, perspective, side view, horizon, volumetric, dramatic lighting, sun, cartoon, drawing, text, watermark"
-        print(f"Prompt: {prompt}", file=sys.stderr)
-        print(f"Negative: {negative}", file=sys.stderr)
-
-        # Generate at SDXL native resolution (1024x1024), then downscale
-        with torch.no_grad():
-            generated = pipe(
-                prompt=prompt,
-                negative_prompt=negative,
-                num_inference_steps=args.steps,
-                guidance_scale=args.guidance,
-                width=1024,
-                height=1024,
-                generator=generator,
-            ).images[0]
+    # Composite: blend generated image into masked area with feathered edges
+    # (grayscale in heightmap mode, RGB in texture mode)
+    gen_arr = np.array(generated)
+    orig_arr = np.array(image)
 
-        generated = generated.resize((512, 512), Image.LANCZOS)
-        generated.save(os.path.join(debug_dir, "generated_raw.png"))
+    # Feather the mask for smooth blending
+    alpha = feather_mask(np.array(mask), args.feather)
 
-        # In heightmap mode, convert to grayscale
-        if args.mode == "heightmap":
-            generated = generated.convert("L")
-            generated.save(os.path.join(debug_dir, "generated_grayscale.png"))
-            image = image.convert("L")
+    result = Image.fromarray(blend_masked(orig_arr, gen_arr, alpha))
 
-        # Composite: blend generated image into masked area with feathered edges
-        gen_arr = np.array(generated).astype(np.float32)
-        orig_arr = np.array(image).astype(np.float32)
+    save_png(result, args.output)
+    if args.debug:
+        save_debug(result, "output_result.png")
+    return {"success": True, "output": args.output}
 
-        # Feather the mask for smooth blending
-        mask_feathered = mask.filter(ImageFilter.GaussianBlur(radius=args.feather))
-        alpha = np.array(mask_feathered).astype(np.float32) / 255.0
 
-        if gen_arr.ndim == 2:
-            # Grayscale (heightmap mode)
-            composite = orig_arr * (1 - alpha) + gen_arr * alpha
-        else:
-            # RGB (texture mode)
-            composite = orig_arr * (1 - alpha[:, :, None]) + gen_arr * alpha[:, :, None]
-        result = Image.fromarray(composite.clip(0, 255).astype(np.uint8))
+def main():
+    args = build_parser(worker="--worker" in sys.argv[1:]).parse_args()
 
-        result.save(args.output)
-        result.save(os.path.join(debug_dir, "output_result.png"))
-        print(json.dumps({"success": True, "output": args.output}))
+    try:
+        init_torch_env()
+
+        pipe, device, prompts = load_pipeline(args)
+
+        if args.worker:
+            serve(lambda job_args: generate(pipe, device, prompts, job_args), args, LOAD_ARGS)
+        else:
+            print(json.dumps(generate(pipe, device, prompts, args)))
 
     except Exception as e:
         import traceback
         traceback.print_exc(file=sys.stderr)
-        print(json.dumps({"success": False, "error": str(e)}))
+        print(json.dumps(error_status(e)))
         sys.exit(1)
 
 
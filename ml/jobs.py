@@ -0,0 +1,80 @@
+"""JSON job loop for running a script as a persistent worker.
+
+With --worker, a script loads its model once and then serves jobs from
+stdin, so the host pays import and from_pretrained cost once per session
+instead of once per request.
+
+Protocol: one JSON object per line on stdin. Its keys use the script's
+argument names (dashes as underscores) and override the values the worker
+was started with, except options that only take effect while loading the
+model (a job setting one of those is rejected). One JSON status line per
+job is written to stdout. Logs go to stderr. The loop exits when stdin is
+closed.
+
+Also holds the startup setup shared by the scripts and worker.py.
+"""
+
+import argparse
+import json
+import os
+import sys
+import traceback
+
+# Load-time options added by add_pipeline_args()
+PIPELINE_LOAD_ARGS = ("quantize", "no_compile")
+
+
+def init_torch_env():
+    """Set the environment variables torch reads. Call before importing torch."""
+    os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
+    # Must be set before torch initializes CUDA. Expandable segments stop long-lived
+    # workers from fragmenting into "reserved but unallocated" memory.
+    os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:512")
+
+
+def add_pipeline_args(parser):
+    """Add the options shared by the diffusion scripts and worker.py."""
+    parser.add_argument("--quantize", type=str, default="auto", choices=["auto", "none", "int8", "fp8"],
+                        help="UNet weight quantization on CUDA (auto = fp8 on sm89+ GPUs)")
+    parser.add_argument("--no-compile", action="store_true",
+                        help="Skip torch.compile and use plain CUDA Graph capture (faster cold start)")
+    parser.add_argument("--debug", action="store_true",
+                        help="Save intermediate images to ml/debug and log mask stats")
+
+
+def error_status(e):
+    """JSON status for a failed job. The exception type is kept because many
+    torch errors and assertions have an empty message."""
+    message = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+    return {"success": False, "error": message}
+
+
+def check_job(job, load_args):
+    """Raise if a job tries to set an option in `load_args`."""
+    fixed = sorted(set(job) & set(load_args))
+    if fixed:
+        raise ValueError(f"Option(s) fixed when the worker starts: {', '.join(fixed)}")
+
+
+def merge_job(base_args, job, load_args=()):
+    """Overlay a job's keys on `base_args`, rejecting any in `load_args`."""
+    check_job(job, load_args)
+    return argparse.Namespace(**{**vars(base_args), **job})
+
+
+def serve(handler, base_args, load_args=()):
+    """Run `handler(args)` for every job on stdin and print its JSON result.
+
+    `load_args` names the options the loaded model was built with.
+    """
+    for line in iter(sys.stdin.readline, ""):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            args = merge_job(base_args, json.loads(line), load_args)
+            result = handler(args)
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            result = error_status(e)
+        print(json.dumps(result), flush=True)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Single persistent worker for all ML tasks.
+
+Hosts every model in one process so the tasks share one CUDA context,
+one torch/diffusers import and one caching allocator instead of paying
+for each per script. Models load lazily on their first job and then stay
+resident, except that at most one diffusion pipeline is kept: SDXL and
+SD 1.5 + ControlNet together do not fit on 12 GB GPUs or 16 GB Macs, so
+switching between them unloads the other one first. Depth Anything is
+small and stays loaded alongside either.
+
+Tasks:
+    inpaint     SDXL generation + compositing (inpaint.py)
+    controlnet  SD 1.5 + ControlNet depth texture generation (controlnet_texture.py)
+    depth       Depth Anything V2 depth estimation (depth_estimate.py)
+
+Usage:
+    python worker.py [--no-compile] [--quantize auto] [--turbo] [--debug]
+
+Same JSON-lines protocol as jobs.py, with an extra "task" key per job, e.g.
+    {"task": "depth", "input": "in.png", "output": "out.bin", "width": 512, "height": 512}
+Startup flags are forwarded to each task's own argument parser as defaults.
+"""
+
+import argparse
+import json
+import sys
+
+import controlnet_texture
+import depth_estimate
+import inpaint
+from jobs import add_pipeline_args, check_job, error_status, init_torch_env, merge_job, serve
+
+# task -> (module, load function, job function)
+TASKS = {
+    "inpaint": (inpaint, inpaint.load_pipeline, inpaint.generate),
+    "controlnet": (controlnet_texture, controlnet_texture.load_pipeline, controlnet_texture.generate),
+    "depth": (depth_estimate, depth_estimate.load_model, depth_estimate.estimate),
+}
+
+# Tasks holding a diffusion pipeline; only one of these is loaded at a time
+DIFFUSION_TASKS = ("inpaint", "controlnet")
+
+
+def free_memory():
+    """Return memory freed by dropped models to the device."""
+    import gc
+
+    import torch
+
+    # Compiled graphs (and their CUDA Graph pools) still reference the old modules.
+    # This also drops the depth model's compiled code, which recompiles on its next job.
+    torch._dynamo.reset()
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    elif torch.backends.mps.is_available():
+        torch.mps.empty_cache()
+
+
+class Worker:
+    def __init__(self, argv):
+        self.argv = argv
+        self.defaults = {}
+        self.loaded = {}
+
+    def run(self, args):
+        job = vars(args)
+        task = job.pop("task", None)
+        if task not in TASKS:
+            raise ValueError(f"Unknown task: {task!r} (expected one of {', '.join(TASKS)})")
+        module, load, run = TASKS[task]
+        check_job(job, module.LOAD_ARGS)
+
+        if task not in self.loaded:
+            if task in DIFFUSION_TASKS:
+                self.unload([t for t in DIFFUSION_TASKS if t in self.loaded])
+
+            # Each task only picks up the startup flags its own parser knows
+            base, _ = module.build_parser(worker=True).parse_known_args(self.argv)
+            self.defaults[task] = base
+            self.loaded[task] = load(base)
+            print(f"Loaded {task} model", file=sys.stderr)
+
+        job_args = merge_job(self.defaults[task], job)
+        return run(*self.loaded[task], job_args)
+
+    def unload(self, tasks):
+        if not tasks:
+            return
+        for task in tasks:
+            del self.loaded[task]
+            print(f"Unloaded {task} model", file=sys.stderr)
+        free_memory()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent ML worker (JSON jobs on stdin)")
+    add_pipeline_args(parser)
+    parser.add_argument("--turbo", action="store_true", help="Use SDXL-Turbo for the inpaint task")
+    parser.parse_args()
+
+    try:
+        init_torch_env()
+
+        serve(Worker(sys.argv[1:]).run, argparse.Namespace())
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc(file=sys.stderr)
+        print(json.dumps(error_status(e)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
-use std::io::Read;
-use std::path::PathBuf;
-use std::process::Command;
+use std::io::{BufRead, BufReader, Read, Write};
+use std::path::{Path, PathBuf};
+use std::process::{Child, ChildStdin, ChildStdout, Command, Stdio};
+use std::sync::Mutex;
 
 /// Locate the Python binary inside the ml/venv.
 /// Falls back to system `python3` if venv doesn't exist.
@@ -23,6 +24,91 @@ pub fn project_root(_app_handle: &tauri::AppHandle) -> PathBuf {
     manifest_dir.parent().unwrap_or(&manifest_dir).to_path_buf()
 }
 
+/// The ml/worker.py process: models stay loaded between jobs, which are exchanged
+/// as one JSON object per line over stdin/stdout (see ml/jobs.py).
+struct Worker {
+    child: Child,
+    stdin: ChildStdin,
+    stdout: BufReader<ChildStdout>,
+}
+
+impl Worker {
+    fn spawn(python: &Path, script: &Path) -> Result<Self, String> {
+        let mut child = Command::new(python)
+            .arg(script)
+            .stdin(Stdio::piped())
+            .stdout(Stdio::piped())
+            // Logs go straight to our stderr; a piped stderr nobody drains would block the worker
+            .stderr(Stdio::inherit())
+            .spawn()
+            .map_err(|e| format!("Failed to spawn Python: {e}"))?;
+        let stdin = child.stdin.take().ok_or("Failed to open Python worker stdin")?;
+        let stdout = child.stdout.take().ok_or("Failed to open Python worker stdout")?;
+        Ok(Self { child, stdin, stdout: BufReader::new(stdout) })
+    }
+
+    fn is_alive(&mut self) -> bool {
+        matches!(self.child.try_wait(), Ok(None))
+    }
+
+    /// Send one job and wait for its JSON status line.
+    fn request(&mut self, job: &serde_json::Value) -> Result<serde_json::Value, String> {
+        writeln!(self.stdin, "{job}")
+            .and_then(|_| self.stdin.flush())
+            .map_err(|e| format!("Failed to send job to Python worker: {e}"))?;
+
+        let mut line = String::new();
+        loop {
+            line.clear();
+            let n = self
+                .stdout
+                .read_line(&mut line)
+                .map_err(|e| format!("Failed to read Python worker output: {e}"))?;
+            if n == 0 {
+                return Err("Python worker exited unexpectedly (see stderr)".to_string());
+            }
+            // Skip anything a library printed to stdout that isn't a status object
+            if let Ok(status) = serde_json::from_str::<serde_json::Value>(line.trim()) {
+                if status.is_object() {
+                    return Ok(status);
+                }
+            }
+        }
+    }
+}
+
+impl Drop for Worker {
+    fn drop(&mut self) {
+        let _ = self.child.kill();
+        let _ = self.child.wait();
+    }
+}
+
+/// Started on first use. Exits on its own when the app quits and its stdin closes.
+/// The mutex also serializes jobs, which share one GPU anyway.
+static WORKER: Mutex<Option<Worker>> = Mutex::new(None);
+
+/// Run a job on the persistent ML worker, (re)starting it if needed.
+/// The first job per task includes model load time.
+fn run_worker_job(root: &Path, job: serde_json::Value) -> Result<serde_json::Value, String> {
+    let script = root.join("ml/worker.py");
+    if !script.exists() {
+        return Err(format!("ML worker script not found: {}", script.display()));
+    }
+
+    let mut worker = WORKER.lock().unwrap();
+    if !worker.as_mut().is_some_and(Worker::is_alive) {
+        *worker = Some(Worker::spawn(&python_bin(root), &script)?);
+    }
+
+    let result = worker.as_mut().unwrap().request(&job);
+    if result.is_err() {
+        // Broken pipe or dead process: drop it so the next call starts fresh
+        *worker = None;
+    }
+    result
+}
+
 /// Run depth estimation: takes a PNG image, returns raw f32 heightmap data.
 pub fn run_depth_estimation(
     app_handle: &tauri::AppHandle,
@@ -31,12 +117,6 @@ pub fn run_depth_estimation(
     height: u32,
 ) -> Result<Vec<f32>, String> {
     let root = project_root(app_handle);
-    let python = python_bin(&root);
-    let script = root.join("ml/depth_estimate.py");
-
-    if !script.exists() {
-        return Err(format!("Depth estimation script not found: {}", script.display()));
-    }
 
     // Write input PNG to temp file
     let tmp_dir = std::env::temp_dir().join("topograph");
@@ -48,33 +128,16 @@ pub fn run_depth_estimation(
     std::fs::write(&input_path, image_data)
         .map_err(|e| format!("Failed to write input PNG: {e}"))?;
 
-    // Spawn Python subprocess
-    let output = Command::new(&python)
-        .arg(&script)
-        .arg("--input")
-        .arg(&input_path)
-        .arg("--output")
-        .arg(&output_path)
-        .arg("--width")
-        .arg(width.to_string())
-        .arg("--height")
-        .arg(height.to_string())
-        .output()
-        .map_err(|e| format!("Failed to spawn Python: {e}"))?;
-
-    if !output.status.success() {
-        let stderr = String::from_utf8_lossy(&output.stderr);
-        let stdout = String::from_utf8_lossy(&output.stdout);
-        return Err(format!(
-            "Depth estimation failed (exit code {:?}):\nstdout: {stdout}\nstderr: {stderr}",
-            output.status.code()
-        ));
-    }
-
-    // Parse JSON status from stdout
-    let stdout = String::from_utf8_lossy(&output.stdout);
-    let status: serde_json::Value = serde_json::from_str(stdout.trim())
-        .map_err(|e| format!("Failed to parse Python output: {e}\nRaw: {stdout}"))?;
+    let status = run_worker_job(
+        &root,
+        serde_json::json!({
+            "task": "depth",
+            "input": input_path,
+            "output": output_path,
+            "width": width,
+            "height": height,
+        }),
+    )?;
 
     if status["success"] != true {
         let error = status["error"].as_str().unwrap_or("Unknown error");
@@ -118,13 +181,6 @@ pub fn run_inpainting(
     mode: &str,
 ) -> Result<Vec<u8>, String> {
     let root = project_root(app_handle);
-    let python = python_bin(&root);
-    let script = root.join("ml/inpaint.py");
-
-    if !script.exists() {
-        return Err(format!("Inpainting script not found: {}", script.display()));
-    }
-
     let tmp_dir = std::env::temp_dir().join("topograph");
     std::fs::create_dir_all(&tmp_dir).map_err(|e| format!("Failed to create temp dir: {e}"))?;
 
@@ -137,32 +193,17 @@ pub fn run_inpainting(
     std::fs::write(&mask_path, mask_data)
         .map_err(|e| format!("Failed to write mask: {e}"))?;
 
-    let output = Command::new(&python)
-        .arg(&script)
-        .arg("--image")
-        .arg(&image_path)
-        .arg("--mask")
-        .arg(&mask_path)
-        .arg("--prompt")
-        .arg(prompt)
-        .arg("--output")
-        .arg(&output_path)
-        .arg("--mode")
-        .arg(mode)
-        .output()
-        .map_err(|e| format!("Failed to spawn Python: {e}"))?;
-
-    if !output.status.success() {
-        let stderr = String::from_utf8_lossy(&output.stderr);
-        let stdout = String::from_utf8_lossy(&output.stdout);
-        return Err(format!(
-            "Inpainting failed:\nstdout: {stdout}\nstderr: {stderr}"
-        ));
-    }
-
-    let stdout = String::from_utf8_lossy(&output.stdout);
-    let status: serde_json::Value = serde_json::from_str(stdout.trim())
-        .map_err(|e| format!("Failed to parse Python output: {e}\nRaw: {stdout}"))?;
+    let status = run_worker_job(
+        &root,
+        serde_json::json!({
+            "task": "inpaint",
+            "image": image_path,
+            "mask": mask_path,
+            "prompt": prompt,
+            "output": output_path,
+            "mode": mode,
+        }),
+    )?;
 
     if status["success"] != true {
         let error = status["error"].as_str().unwrap_or("Unknown error");
@@ -230,16 +271,6 @@ pub fn run_controlnet_texture(
     hm_height: u32,
 ) -> Result<Vec<u8>, String> {
     let root = project_root(app_handle);
-    let python = python_bin(&root);
-    let script = root.join("ml/controlnet_texture.py");
-
-    if !script.exists() {
-        return Err(format!(
-            "ControlNet texture script not found: {}",
-            script.display()
-        ));
-    }
-
     let tmp_dir = std::env::temp_dir().join("topograph");
     std::fs::create_dir_all(&tmp_dir).map_err(|e| format!("Failed to create temp dir: {e}"))?;
 
@@ -261,32 +292,17 @@ pub fn run_controlnet_texture(
     std::fs::write(&mask_path, mask_data)
         .map_err(|e| format!("Failed to write mask: {e}"))?;
 
-    let output = Command::new(&python)
-        .arg(&script)
-        .arg("--image")
-        .arg(&image_path)
-        .arg("--depth")
-        .arg(&depth_path)
-        .arg("--mask")
-        .arg(&mask_path)
-        .arg("--prompt")
-        .arg(prompt)
-        .arg("--output")
-        .arg(&output_path)
-        .output()
-        .map_err(|e| format!("Failed to spawn Python: {e}"))?;
-
-    if !output.status.success() {
-        let stderr = String::from_utf8_lossy(&output.stderr);
-        let stdout = String::from_utf8_lossy(&output.stdout);
-        return Err(format!(
-            "ControlNet texture generation failed:\nstdout: {stdout}\nstderr: {stderr}"
-        ));
-    }
-
-    let stdout = String::from_utf8_lossy(&output.stdout);
-    let status: serde_json::Value = serde_json::from_str(stdout.trim())
-        .map_err(|e| format!("Failed to parse Python output: {e}\nRaw: {stdout}"))?;
+    let status = run_worker_job(
+        &root,
+        serde_json::json!({
+            "task": "controlnet",
+            "image": image_path,
+            "depth": depth_path,
+            "mask": mask_path,
+            "prompt": prompt,
+            "output": output_path,
+        }),
+    )?;
 
     if status["success"] != true {
         let error = status["error"].as_str().unwrap_or("Unknown error");